@@ -21,13 +21,14 @@ import math
 import re
 
 import numpy as np
-from astropy.modeling import FittableModel, Parameter, fitting, models
+from astropy.modeling import FittableModel, Parameter, models
 from astropy.modeling.core import Model, CompoundModel
 from astropy.stats import sigma_clip
 from astropy.table import Table
 from astropy import units as u
 from astropy.io.fits import Header
 from scipy.interpolate import BSpline, LSQUnivariateSpline, UnivariateSpline
+from scipy.ndimage import binary_dilation
 
 # -----------------------------------------------------------------------------
 # NEW MODEL CLASSES
@@ -65,37 +66,55 @@ class Pix2Sky(FittableModel):
     def __init__(self, wcs, x_offset=0.0, y_offset=0.0, factor=1.0,
                  angle=0.0, origin=1, **kwargs):
         self._wcs = wcs.deepcopy()
+        # Without distortions, the all_* methods reduce to the core WCS
+        # transformations, which are much cheaper (no iterative inverse)
+        self._has_distortion = self._wcs.has_distortion
         self._direction = 1  # pix->sky direction
         self._origin = origin
+        self._cached_wcs = None
+        self._cached_params = None
         super().__init__(x_offset, y_offset, factor, angle, **kwargs)
 
     def evaluate(self, x, y, x_offset, y_offset, factor, angle):
         # x_offset and y_offset are actually arrays in the Model
         #temp_wcs = self.wcs(x_offset[0], y_offset[0], factor, angle)
-        temp_wcs = self.wcs
-        return temp_wcs.all_pix2world(x, y, self._origin) if self._direction > 0 \
-            else temp_wcs.all_world2pix(x, y, self._origin)
+        temp_wcs = self._modified_wcs()
+        if self._has_distortion:
+            return temp_wcs.all_pix2world(x, y, self._origin) if self._direction > 0 \
+                else temp_wcs.all_world2pix(x, y, self._origin)
+        return temp_wcs.wcs_pix2world(x, y, self._origin) if self._direction > 0 \
+            else temp_wcs.wcs_world2pix(x, y, self._origin)
 
     @property
     def inverse(self):
-        inv = self.copy()
+        inv = self.__class__(self._wcs, *self.parameters, origin=self._origin,
+                             name=self.name, fixed=dict(self.fixed),
+                             tied=dict(self.tied))
         inv._direction = -self._direction
         return inv
 
     @property
     def wcs(self):
         """Return the WCS modified by the translation/scaling/rotation"""
+        # Return a copy so callers cannot alter the cached WCS
+        return self._modified_wcs().deepcopy()
+
+    def _modified_wcs(self):
+        # Fitters evaluate the model many times with the same parameters,
+        # so only rebuild the WCS when one of them has changed
+        params = tuple(self.parameters)
+        if params == self._cached_params:
+            return self._cached_wcs
+        x_offset, y_offset, factor, angle = params
         wcs = self._wcs.deepcopy()
-        x_offset = self.x_offset.value
-        y_offset = self.y_offset.value
-        angle = self.angle.value
-        factor = self.factor.value
         wcs.wcs.crpix += np.array([x_offset, y_offset])
         if factor != 1:
             wcs.wcs.cd *= factor
         if angle != 0.0:
             m = models.Rotation2D(angle)
             wcs.wcs.cd = m(*wcs.wcs.cd)
+        self._cached_wcs = wcs
+        self._cached_params = params
         return wcs
 
 
@@ -110,10 +129,11 @@ class Shift2D(FittableModel):
 
     @property
     def inverse(self):
-        inv = self.copy()
-        inv.x_offset = -self.x_offset
-        inv.y_offset = -self.y_offset
-        return inv
+        # Construct directly as copy() is slow; bounds are not inverted, so
+        # they are dropped, but fixed/tied are kept for refitting the inverse
+        return self.__class__(-self.x_offset.value, -self.y_offset.value,
+                              name=self.name, fixed=dict(self.fixed),
+                              tied=dict(self.tied))
 
     @staticmethod
     def evaluate(x, y, x_offset, y_offset):
@@ -133,9 +153,8 @@ class Scale2D(FittableModel):
 
     @property
     def inverse(self):
-        inv = self.copy()
-        inv.factor = 1.0 / self.factor
-        return inv
+        return self.__class__(1.0 / self.factor.value, name=self.name,
+                              fixed=dict(self.fixed), tied=dict(self.tied))
 
     @staticmethod
     def evaluate(x, y, factor):
@@ -155,20 +174,25 @@ class Rotate2D(FittableModel):
 
     @property
     def inverse(self):
-        inv = self.copy()
-        inv.angle = -self.angle
-        return inv
+        # angle.value is in degrees, as the constructor expects
+        return self.__class__(-self.angle.value, name=self.name,
+                              fixed=dict(self.fixed), tied=dict(self.tied))
 
     @staticmethod
     def evaluate(x, y, angle):
         if x.shape != y.shape:
             raise ValueError("Expected input arrays to have the same shape")
-        orig_shape = x.shape or (1,)
-        inarr = np.array([x.flatten(), y.flatten()])
+        # The angle arrives as a 1-element array, so convert it to a Python
+        # float once rather than in both math calls
+        angle = np.asarray(angle).item()
         s, c = math.sin(angle), math.cos(angle)
-        x, y = np.dot(np.array([[c, -s], [s, c]], dtype=np.float64), inarr)
-        x.shape = y.shape = orig_shape
-        return x, y
+        # Rotate without stacking the inputs into a (2, N) array; this
+        # avoids two copies and the reshape afterwards
+        xout = np.multiply(c, x, dtype=np.float64)
+        xout -= np.multiply(s, y, dtype=np.float64)
+        yout = np.multiply(s, x, dtype=np.float64)
+        yout += np.multiply(c, y, dtype=np.float64)
+        return xout, yout
 
 
 class UnivariateSplineWithOutlierRemoval:
@@ -267,31 +291,36 @@ class UnivariateSplineWithOutlierRemoval:
             y = y.data
 
         if w is not None:
-            orig_mask |= (w == 0)
+            zero_weights = (w == 0)
+            orig_mask |= zero_weights
 
         if debug:
             print('y=', y)
             print('orig_mask=', orig_mask.astype(int))
 
+        x_to_fit = np.asarray(x, dtype=float)
         iteration = 0
         full_mask = orig_mask  # Will include pixels masked because of "grow"
         while iteration < niter+1:
             last_mask = full_mask
-            x_to_fit = x.astype(float)
 
+            good_indices = np.flatnonzero(~full_mask)
             if order is not None:
                 # Determine actual order to apply based on fraction of unmasked
                 # pixels, and unmask everything if there are too few good pixels
-                this_order = int(order * (1 - np.sum(full_mask) / full_mask.size) + 0.5)
+                n_masked = full_mask.size - good_indices.size
+                this_order = int(order * (1 - n_masked / full_mask.size) + 0.5)
                 if this_order == 0 and order > 0:
                     full_mask = np.zeros(x.shape, dtype=bool)
-                    if w is not None and not all(w == 0):
-                        full_mask |= (w == 0)
-                    this_order = int(order * (1 - np.sum(full_mask) / full_mask.size) + 0.5)
+                    if w is not None and not zero_weights.all():
+                        full_mask |= zero_weights
+                    good_indices = np.flatnonzero(~full_mask)
+                    n_masked = full_mask.size - good_indices.size
+                    this_order = int(order * (1 - n_masked / full_mask.size) + 0.5)
                     if debug:
                         print("FULL MASK", full_mask)
 
-            xgood = x_to_fit[~full_mask]
+            xgood = x_to_fit[good_indices]
             while True:
                 if debug:
                     print(f"Iter {iteration}: epsf loop")
@@ -302,36 +331,42 @@ class UnivariateSplineWithOutlierRemoval:
                 if order is None:
                     raise ValueError("Must specify spline order when there are "
                                      "duplicate x values")
-                for i in range(xgood.size):
-                    if i not in indices:
-                        xgood[i] *= (1.0 + epsf)
+                duplicates = np.ones(xgood.size, dtype=bool)
+                duplicates[indices] = False
+                xgood[duplicates] *= (1.0 + epsf)
 
             # Space knots equally based on density of unique x values
             if order is not None:
-                knots = [xunique[int(xx+0.5)]
-                         for xx in np.linspace(0, xunique.size-1, this_order+1)[1:-1]]
+                knot_indices = (np.linspace(0, xunique.size-1, this_order+1)[1:-1]
+                                + 0.5).astype(int)
+                knots = xunique[knot_indices]
                 spline_args = (knots,)
                 if debug:
                     print("KNOTS", knots)
 
             sort_indices = np.argsort(xgood)
+            # Indices of the good points in the original arrays, in x order
+            sorted_good_indices = good_indices[sort_indices]
             # Create appropriate spline object using current mask
             if order is None or this_order > 0:
                 spline = cls_(
-                    xgood[sort_indices], y[~full_mask][sort_indices],
+                    xgood[sort_indices], y[sorted_good_indices],
                     *spline_args,
-                    w=None if w is None else w[~full_mask][sort_indices],
+                    w=None if w is None else w[sorted_good_indices],
                     **spline_kwargs
                 )
             else:
-                avg_y = np.average(y[~full_mask],
-                                   weights=None if w is None else w[~full_mask])
+                avg_y = np.average(y[good_indices],
+                                   weights=None if w is None else w[good_indices])
                 spline = lambda xx: avg_y
 
             spline_y = spline(x)
-            masked_residuals = outlier_func(np.ma.array(spline_y - y,
-                                                        mask=full_mask),
-                                            **outlier_kwargs)
+            residuals = spline_y - y
+            # sigma_clip is faster with a plain array, so only make a
+            # masked array if something is masked (or for other functions)
+            if outlier_func is not sigma_clip or full_mask.any():
+                residuals = np.ma.array(residuals, mask=full_mask)
+            masked_residuals = outlier_func(residuals, **outlier_kwargs)
             mask = masked_residuals.mask
 
             if debug:
@@ -340,16 +375,16 @@ class UnivariateSplineWithOutlierRemoval:
             if grow > 0:
                 new_mask = mask ^ full_mask
                 if new_mask.any():
-                    for i in range(1, grow + 1):
-                        mask[i:] |= new_mask[:-i]
-                        mask[:-i] |= new_mask[i:]
+                    mask |= binary_dilation(new_mask,
+                                            structure=np.ones(2 * grow + 1,
+                                                              dtype=bool))
                     if debug:
                         print('mask after growth=', mask.astype(int))
 
             full_mask = mask
 
             # Check if the mask is unchanged
-            if not np.logical_or.reduce(last_mask ^ full_mask):
+            if np.array_equal(last_mask, full_mask):
                 if debug:
                     print(f"Iter {iteration}: Breaking")
                 break
@@ -357,9 +392,10 @@ class UnivariateSplineWithOutlierRemoval:
                 print(f"Iter {iteration}: Starting new iteration")
             iteration += 1
 
-        # Create a standard BSpline object
+        # Create a standard BSpline object. The knots and coefficients come
+        # straight from FITPACK, so they don't need validating or copying
         try:
-            bspline = BSpline(*spline._eval_args)
+            bspline = BSpline.construct_fast(*spline._eval_args)
         except AttributeError:
             # Create a spline object that's just a constant
             bspline = BSpline(np.r_[(x[0],)*4, (x[-1],)*4],
@@ -373,6 +409,11 @@ class UnivariateSplineWithOutlierRemoval:
 # -----------------------------------------------------------------------------
 # MODEL <-> TABLE FUNCTIONS
 #
+# Column names of the coefficients of 1D and 2D polynomial-type models
+_COEFF_1D_REGEX = re.compile("c([0-9]+)")
+_COEFF_2D_REGEX = re.compile("c([0-9]+)_([0-9]+)")
+
+
 def model_to_table(model, xunit=None, yunit=None, zunit=None):
     """
     Convert a model instance to a Table, suitable for attaching to an AstroData
@@ -471,21 +512,23 @@ def table_to_model(table):
         ndim = int(model_class[-2])
         table_dict = dict(zip(table.colnames, table))
         if ndim == 1:
-            r = re.compile("c([0-9]+)")
-            param_names = list(filter(r.match, table.colnames))
+            matches = [m for m in map(_COEFF_1D_REGEX.match, table.colnames)
+                       if m]
+            param_names = [m.string for m in matches]
             # Handle cases (e.g., APERTURE tables) where the number of
             # columns must be the same for all rows but the degree of
             # polynomial might be different
-            degree = max([int(r.match(p).groups()[0]) for p in param_names
-                          if table[p] is not np.ma.masked])
+            degree = max(int(m.group(1)) for m in matches
+                         if table[m.string] is not np.ma.masked)
             domain = [table_dict.get("domain_start", meta.get("DOMAIN_START", 0)),
                       table_dict.get("domain_end", meta.get("DOMAIN_END", 1))]
             model = cls(degree=degree, domain=domain)
         elif ndim == 2:
-            r = re.compile("c([0-9]+)_([0-9]+)")
-            param_names = list(filter(r.match, table.colnames))
-            xdegree = max([int(r.match(p).groups()[0]) for p in param_names])
-            ydegree = max([int(r.match(p).groups()[1]) for p in param_names])
+            matches = [m for m in map(_COEFF_2D_REGEX.match, table.colnames)
+                       if m]
+            param_names = [m.string for m in matches]
+            xdegree = max(int(m.group(1)) for m in matches)
+            ydegree = max(int(m.group(2)) for m in matches)
             xdomain = [table_dict.get("xdomain_start", meta.get("XDOMAIN_START", 0)),
                        table_dict.get("xdomain_end", meta.get("XDOMAIN_END", 1))]
             ydomain = [table_dict.get("ydomain_start", meta.get("YDOMAIN_START", 0)),
@@ -528,19 +571,32 @@ def make_inverse_chebyshev1d(model, sampling=1, rms=None, max_deviation=None):
     """
     order = model.degree
     max_order = order if (rms is None and max_deviation is None) else order + 2
-    incoords = np.arange(*model.domain, sampling)
+    in_domain = model.domain
+    incoords = np.arange(*in_domain, sampling)
     outcoords = model(incoords)
+    domain = model(in_domain)
+
+    # The points to fit don't change as the order is increased, so compute
+    # the Chebyshev basis up to the maximum order once and fit each order
+    # with the appropriate number of its columns. The fit is the same as
+    # LinearLSQFitter's: map the domain to [-1, 1] and scale the columns.
+    scale = 2 / (domain[1] - domain[0])
+    design_matrix = np.polynomial.chebyshev.chebvander(
+        scale * outcoords - scale * domain.mean(), max_order)
     while order <= max_order:
-        m_init = models.Chebyshev1D(degree=order, domain=model(model.domain))
-        fit_it = fitting.LinearLSQFitter()
-        m_inverse = fit_it(m_init, outcoords, incoords)
-        trans_coords = m_inverse(outcoords)
+        lhs = design_matrix[:, :order+1]
+        scl = (lhs * lhs).sum(axis=0)
+        coeffs = np.linalg.lstsq(lhs / scl, incoords, rcond=None)[0] / scl
+        # Evaluate the inverse at outcoords without making a model
+        trans_coords = lhs @ coeffs
         rms_inverse = np.std(trans_coords - incoords)
         max_dev = np.max(abs(trans_coords - incoords))
         if ((rms is None or rms_inverse <= rms) and
                 (max_deviation is None or max_dev <= max_deviation)):
             break
         order += 1
+    m_inverse = models.Chebyshev1D(degree=coeffs.size-1, domain=domain)
+    m_inverse.parameters = coeffs
     return m_inverse
 
 
@@ -4,8 +4,9 @@ Tests for the astromodels module.
 import pytest
 import numpy as np
 
-from astropy.modeling import models
+from astropy.modeling import fitting, models
 from astropy import units as u
+from astropy.wcs import WCS, Sip
 from scipy.interpolate import BSpline
 
 from gempy.library import astromodels as am
@@ -51,3 +52,100 @@ def test_spline_table_recovery(k):
     assert m2.meta["xunit"] is u.nm
     assert m2.meta["yunit"] is u.electron
 
+
+def test_spline_with_duplicate_x_values():
+    """Duplicated x values are nudged apart so the spline can be fit"""
+    x = np.repeat(np.arange(10.) + 0.5, 3)
+    y = 2 * x + 1
+    spline = am.UnivariateSplineWithOutlierRemoval(x, y, order=3)
+
+    assert isinstance(spline, BSpline)
+    assert not spline.mask.any()
+    np.testing.assert_allclose(spline(x), y)
+
+
+@pytest.mark.parametrize("degree", (1, 2, 3, 4, 5))
+def test_make_inverse_chebyshev1d_matches_fitter(degree):
+    """The inverse is the same as a LinearLSQFitter fit of the same degree"""
+    coeffs = {f"c{i}": c for i, c in enumerate((5000, -600, 3, -0.5, 0.2, -0.05))
+              if i <= degree}
+    model = models.Chebyshev1D(degree=degree, domain=(0, 3131), **coeffs)
+    assert model(0) > model(3131)  # decreasing output domain
+    incoords = np.arange(*model.domain)
+    outcoords = model(incoords)
+
+    m_inverse = am.make_inverse_chebyshev1d(model)
+    m_fit = fitting.LinearLSQFitter()(
+        models.Chebyshev1D(degree, domain=model(model.domain)),
+        outcoords, incoords)
+
+    assert m_inverse.degree == m_fit.degree
+    np.testing.assert_allclose(m_inverse.domain, m_fit.domain)
+    np.testing.assert_allclose(m_inverse.parameters, m_fit.parameters,
+                               rtol=1e-7, atol=1e-9)
+
+    # The order search should stop at the same degree as the fitter would
+    rms = 0.01
+    for order in range(degree, degree + 3):
+        m_fit = fitting.LinearLSQFitter()(
+            models.Chebyshev1D(order, domain=model(model.domain)),
+            outcoords, incoords)
+        if np.std(m_fit(outcoords) - incoords) <= rms:
+            break
+    assert am.make_inverse_chebyshev1d(model, rms=rms).degree == m_fit.degree
+
+
+@pytest.mark.parametrize("model", (am.Shift2D(1, 2, fixed={"y_offset": True}),
+                                   am.Scale2D(1.1, fixed={"factor": True}),
+                                   am.Rotate2D(30, fixed={"angle": True})))
+def test_inverse_keeps_fixed_parameters(model):
+    """Fixed parameters remain fixed in the inverse model"""
+    inverse = model.inverse
+    assert inverse.fixed == model.fixed
+    assert inverse.inverse.fixed == model.fixed
+
+
+@pytest.mark.parametrize("distortion", (False, True))
+def test_pix2sky_follows_parameter_changes(distortion):
+    """Pix2Sky output changes with its parameters and not via its wcs"""
+    w = WCS(naxis=2)
+    w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    w.wcs.crpix = [100, 100]
+    w.wcs.crval = [150, 2]
+    w.wcs.cd = [[-1e-4, 0], [0, 1e-4]]
+    if distortion:
+        w.wcs.ctype = ["RA---TAN-SIP", "DEC--TAN-SIP"]
+        a = np.zeros((3, 3))
+        b = np.zeros((3, 3))
+        a[2, 0] = b[0, 2] = 1e-5
+        w.sip = Sip(a, b, None, None, w.wcs.crpix)
+    assert w.has_distortion == distortion
+
+    p = am.Pix2Sky(w, 1, 2)
+    before = p(10, 10)
+    p.wcs.wcs.crpix += 50
+    np.testing.assert_array_equal(p(10, 10), before)
+
+    p.x_offset = 5
+    after = p(10, 10)
+    assert after[0] != before[0]
+    np.testing.assert_array_equal(after, am.Pix2Sky(w, 5, 2)(10, 10))
+    np.testing.assert_allclose(p.inverse(*after), (10, 10))
+
+
+@pytest.mark.parametrize("x", (np.linspace(-5, 5, 11, dtype=np.float32),
+                               np.arange(-5, 6), np.float32(1.5),
+                               np.arange(12, dtype=np.float32).reshape(3, 4)))
+@pytest.mark.parametrize("angle", (-70.5, 0, 30))
+def test_rotate2d_matches_rotation2d(x, angle):
+    """Rotate2D agrees with Rotation2D and returns float64 output"""
+    y = x * 2 - 1
+    m = am.Rotate2D(angle)
+    result = m(x, y)
+    expected = models.Rotation2D(angle)(x.astype(np.float64),
+                                        y.astype(np.float64))
+    for r, e in zip(result, expected):
+        assert np.shape(r) == np.shape(x)
+        assert np.asarray(r).dtype == np.float64
+        np.testing.assert_allclose(r, e, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(m.inverse(*result), (x, y), atol=1e-12)